@@ -0,0 +1,305 @@
+"""
+Wspólny rdzeń monitora Eufy: powiadomienia, log incydentów, klient WS
+i logika zdarzeń. Importowany przez oba punkty wejścia
+(eufy_desktop_gui.py i eufy_monitor_ws.py), żeby optymalizacje
+dotyczyły jednej kopii kodu.
+"""
+import asyncio, threading, functools, json, os, time, queue, random, collections, sqlite3, datetime
+from dataclasses import dataclass
+from typing import Optional
+import orjson
+from plyer import notification
+import websockets
+
+# --------------------- Utils ---------------------
+@functools.lru_cache(maxsize=1)
+def load_cfg(path=None):
+    # cache na cały czas życia procesu — restart WS nie czyta pliku od nowa
+    if path is None:
+        path = os.path.join(os.path.dirname(__file__), "config.json")
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def now_ts():
+    return datetime.datetime.now().isoformat(timespec="seconds")
+
+_human_ts_cache = [0, ""]   # [sekunda, sformatowany napis]
+
+def human_ts(dt=None):
+    if dt is not None:
+        return dt.strftime("%Y-%m-%d %H:%M:%S")
+    # w burstach wiele zdarzeń trafia w tę samą sekundę — format liczymy raz
+    sec = int(time.time())
+    if sec != _human_ts_cache[0]:
+        _human_ts_cache[1] = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(sec))
+        _human_ts_cache[0] = sec
+    return _human_ts_cache[1]
+
+# --------------------- Notifier ------------------
+class Notifier:
+    MAX_KEYS = 1024   # LRU — cooldowny nie rosną bez końca przez dni pracy
+    MAX_PENDING = 32  # więcej i tak nikt nie przeczyta — lepiej upuścić
+
+    def __init__(self, cooldown=90):
+        self.cooldown = cooldown
+        self._last = collections.OrderedDict()
+        # notify() to synchroniczny COM/DBus — nie może blokować pętli WS
+        # ani wątku Tk, więc toasty renderuje osobny wątek roboczy
+        self._pending = queue.Queue(maxsize=self.MAX_PENDING)
+        self._worker = threading.Thread(target=self._loop, daemon=True)
+        self._worker.start()
+    def show(self, title, msg, key=None):
+        t = time.time()
+        if key:
+            prev = self._last.get(key)
+            if prev is not None and t - prev < self.cooldown:
+                return
+            self._last[key] = t
+            self._last.move_to_end(key)
+            if len(self._last) > self.MAX_KEYS:
+                self._last.popitem(last=False)
+        try:
+            self._pending.put_nowait((title, msg))
+        except queue.Full:
+            pass  # zalew zdarzeń — toast i tak by się nie wyświetlił
+    def _loop(self):
+        while True:
+            title, msg = self._pending.get()
+            try:
+                notification.notify(title=title, message=msg, timeout=5)
+            except Exception:
+                pass  # cicho – desktop powiadomienie opcjonalne
+
+# --------------------- Incident Log --------------
+class IncidentLog:
+    """
+    Jedno długożyjące połączenie (WAL) + bufor wpisów zrzucany paczką
+    przez executemany — zamiast connect/commit/close per rekord.
+    """
+    FLUSH_INTERVAL = 0.5   # sekundy
+    FLUSH_ROWS = 64
+    # jeden obiekt str dla wszystkich insertów — sqlite3 trzyma cache
+    # przygotowanych zapytań kluczowany dokładnie tym napisem
+    _SQL_INSERT = "INSERT INTO incidents(ts,source,type,title,details) VALUES (?,?,?,?,?)"
+
+    def __init__(self, path="incidents.db"):
+        self.path = path
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._lock = threading.Lock()
+        self._buf = []
+        self._timer = None
+        self._init()
+    def _init(self):
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS incidents(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ts TEXT NOT NULL,
+            source TEXT NOT NULL,
+            type TEXT NOT NULL,
+            title TEXT NOT NULL,
+            details TEXT
+        )""")
+    def add(self, source, type_, title, details=""):
+        with self._lock:
+            self._buf.append((now_ts(), source, type_, title, details))
+            full = len(self._buf) >= self.FLUSH_ROWS
+            if not full and self._timer is None:
+                self._timer = threading.Timer(self.FLUSH_INTERVAL, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if full:
+            self.flush()
+    def flush(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            rows, self._buf = self._buf, []
+            if not rows:
+                return
+            self.conn.execute("BEGIN")
+            self.conn.executemany(self._SQL_INSERT, rows)
+            self.conn.execute("COMMIT")
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+# --------------------- WS Client -----------------
+class WSClient:
+    """
+    Łączy się z eufy-security-ws i przekazuje zdarzenia do sinka
+    (wywoływanego na wątku WS; sink sam marshalluje do GUI).
+    """
+    def __init__(self, ws_url, sink):
+        self.ws_url = ws_url
+        self.sink = sink                # callable: (kind, payload) -> None
+        self._stop = asyncio.Event()
+
+    async def run(self):
+        backoff = 1.0
+        while not self._stop.is_set():
+            try:
+                # LAN do eufy-security-ws: kompresja per-message tylko pali CPU
+                async with websockets.connect(self.ws_url, ping_interval=20, ping_timeout=20,
+                                              compression=None, max_size=2**20) as ws:
+                    backoff = 1.0
+                    await ws.send(json.dumps({"command":"initialize"}))
+                    await ws.send(json.dumps({"command":"get_devices"}))
+                    await ws.send(json.dumps({"command":"get_stations"}))
+                    # sygnał do GUI
+                    self.sink("conn", {"status":"connected"})
+                    async for raw in ws:
+                        try:
+                            # orjson przyjmuje bytes wprost — bez dekodowania ramki
+                            evt = orjson.loads(raw)
+                        except Exception:
+                            continue
+                        self.sink("event", evt)
+            except Exception as e:
+                self.sink("conn", {"status":"disconnected", "error": str(e)})
+                # wykładniczy backoff z jitterem: szybki powrót po chwilowej
+                # czkawce, bez młócenia serwera przy dłuższej awarii
+                await asyncio.sleep(min(backoff, 60) * (0.5 + random.random()))
+                backoff *= 2
+
+    def stop(self):
+        self._stop.set()
+
+# --------------------- Monitor Logic -------------
+@dataclass(slots=True)
+class DevState:
+    # sloty zamiast dictów per urządzenie — mniejszy footprint, szybszy dostęp
+    name: str
+    online: Optional[bool]
+    last_event: Optional[str]
+
+
+class MonitorLogic:
+    """
+    Przetwarza zdarzenia Eufy i generuje rekordy do GUI.
+    """
+    def __init__(self, cfg, gui_sink, notifier, log_db):
+        self.cfg = cfg
+        self.gui_sink = gui_sink        # callable: (type, payload) -> None (wątki-bezpieczne przez Queue)
+        self.notifier = notifier
+        self.log = log_db
+        self.device_last_ok = {}        # sn -> time.monotonic()
+        self.devices = {}               # sn -> DevState
+        self._offline_grace = cfg["health"]["offline_grace_seconds"]
+        # tabela dyspozycji: jedna haszowana ścieżka zamiast kaskady `t in (...)`
+        self._dispatch = (
+            {k: self._on_listing for k in ("devices", "stations")}
+            | {k: self._on_device for k in ("device", "device update", "property changed")}
+            | {k: self._on_event for k in ("event", "station event", "device event")}
+            | {k: self._on_error for k in ("error", "station error", "device error")}
+        )
+
+    def handle(self, kind, payload):
+        if kind == "conn":
+            self.gui_sink("conn", payload)
+            return
+
+        if kind != "event":
+            return
+
+        evt = payload
+        # eufy-security-ws emituje typy już małymi literami — najpierw
+        # lookup na surowym napisie, .lower() (nowa alokacja) tylko na pudle
+        t = evt.get("type","")
+        handler = self._dispatch.get(t) or self._dispatch.get(t.lower())
+        if handler:
+            handler(evt)
+
+    @staticmethod
+    def _extract(evt):
+        # sn/name wyciągane raz na handler zamiast powtarzania łańcuchów
+        # .get(...) or .get(...) przy każdym użyciu
+        sn = (evt.get("device_sn") or evt.get("serial_number")
+              or evt.get("device_id") or evt.get("station_sn"))
+        name = (evt.get("device_name") or evt.get("name")
+                or evt.get("station_name") or sn)
+        return sn, name
+
+    # --- urządzenia listy / właściwości ---
+    def _on_listing(self, evt):
+        # pełne listy zwracane na start
+        arr = evt.get("data") or []
+        for d in arr:
+            sn = d.get("serial_number") or d.get("device_sn") or d.get("station_sn")
+            name = d.get("name") or d.get("device_name") or d.get("station_name") or sn
+            online = d.get("state") in ("online","connected") or bool(d.get("online"))
+            self.devices[sn] = DevState(name, online, None)
+            if online:
+                self.device_last_ok[sn] = time.monotonic()
+            self.gui_sink("device_update", {"sn": sn, "name": name, "online": online, "last_event": None})
+
+    # --- zmiana właściwości pojedynczego urządzenia ---
+    def _on_device(self, evt):
+        sn, name = self._extract(evt)
+        props = evt.get("properties") or evt.get("data") or {}
+        online = props.get("online") if isinstance(props.get("online"), bool) else (props.get("state") in ("online","connected"))
+        if sn:
+            dev = self.devices.get(sn)
+            if dev is None:
+                dev = self.devices[sn] = DevState(name, None, None)
+            dev.name = name
+            if online is not None:
+                if online and not dev.online:
+                    # recovery
+                    self.notifier.show("Eufy: urządzenie wróciło", f"{name} online", key=f"rec_{sn}")
+                    self.log.add(name, "recovery", "Device reachable", sn)
+                dev.online = online
+                if online:
+                    self.device_last_ok[sn] = time.monotonic()
+            self.gui_sink("device_update", {"sn": sn, "name": name, "online": dev.online, "last_event": dev.last_event})
+
+    # --- zdarzenia ruch/osoba/dzwonek ---
+    def _on_event(self, evt):
+        name = evt.get("device_name") or evt.get("station_name") or "Eufy"
+        action = evt.get("event_type") or evt.get("name") or evt.get("action") or "event"
+        text = evt.get("message") or (evt.get("data") or {}).get("message") or ""
+        sn = evt.get("device_sn") or evt.get("serial_number") or None
+
+        if sn:
+            dev = self.devices.get(sn)
+            if dev is None:
+                dev = self.devices[sn] = DevState(name, True, None)
+            dev.last_event = f"{action}: {text}"[:120]
+            self.device_last_ok[sn] = time.monotonic()
+            self.gui_sink("device_update", {"sn": sn, "name": dev.name, "online": dev.online, "last_event": dev.last_event})
+
+        self.gui_sink("log", f"{human_ts()}  [{name}] {action} — {text}")
+        self.notifier.show(f"Eufy: {action}", f"{name}: {text}", key=f"evt_{name}_{action}")
+        self.log.add(name, "alert", action, text)
+
+    # --- błędy globalne/urządzeń ---
+    def _on_error(self, evt):
+        src = evt.get("device_name") or evt.get("station_name") or "Eufy"
+        msg = evt.get("message") or str(evt)
+        self.gui_sink("log", f"{human_ts()}  [ERROR] {src}: {msg}")
+        self.notifier.show("Eufy: błąd", msg, key=f"err_{src}")
+        self.log.add(src, "error", "Error", msg)
+
+    async def watchdog(self):
+        # okresowy strażnik zamiast sprawdzania przy każdym zdarzeniu:
+        # wykrywa offline także wtedy, gdy zdarzenia w ogóle nie przychodzą
+        while True:
+            await asyncio.sleep(max(self._offline_grace / 4, 1))
+            now = time.monotonic()
+            for sn, last_ok in list(self.device_last_ok.items()):
+                if now - last_ok > self._offline_grace:
+                    self._flag_offline(sn)
+
+    def _flag_offline(self, sn):
+        # oflaguj jako offline jeśli nie było już zgłoszone
+        dev = self.devices.get(sn)
+        if dev is None:
+            dev = self.devices[sn] = DevState(sn, None, None)
+        if dev.online is not False:
+            dev.online = False
+            name = dev.name or sn
+            self.gui_sink("device_update", {"sn": sn, "name": name, "online": False, "last_event": dev.last_event})
+            self.gui_sink("log", f"{human_ts()}  [INCIDENT] {name} offline")
+            self.notifier.show("Eufy: urządzenie offline", f"{name} nie odpowiada.", key=f"off_{sn}")
+            self.log.add(name, "incident", "Device offline", sn)
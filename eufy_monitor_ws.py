@@ -1,72 +1,6 @@
-import asyncio, json, os, sqlite3, datetime
-from plyer import notification
+import asyncio, time
 
-# ---- proste powiadomienia desktop ----
-class Notifier:
-    def __init__(self, cooldown=90):
-        self.cooldown = cooldown
-        self.last = {}
-    def show(self, title, msg, key=None):
-        now = datetime.datetime.now().timestamp()
-        if key and key in self.last and now - self.last[key] < self.cooldown:
-            return
-        if key: self.last[key] = now
-        try:
-            notification.notify(title=title, message=msg, timeout=5)
-        except Exception:
-            print(f"[NOTIFY] {title}: {msg}")
-
-# ---- log incydentów (SQLite) ----
-class IncidentLog:
-    def __init__(self, path="incidents.db"):
-        self.path = path
-        self._init()
-    def _init(self):
-        conn = sqlite3.connect(self.path)
-        c = conn.cursor()
-        c.execute("""CREATE TABLE IF NOT EXISTS incidents(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            ts TEXT NOT NULL,
-            source TEXT NOT NULL,
-            type TEXT NOT NULL,
-            title TEXT NOT NULL,
-            details TEXT
-        )""")
-        conn.commit(); conn.close()
-    def add(self, source, type_, title, details=""):
-        conn = sqlite3.connect(self.path)
-        c = conn.cursor()
-        c.execute("INSERT INTO incidents(ts,source,type,title,details) VALUES (?,?,?,?,?)",
-                  (datetime.datetime.now().isoformat(timespec="seconds"), source, type_, title, details))
-        conn.commit(); conn.close()
-
-# ---- klient Eufy WebSocket ----
-# Używamy prostego websocketu; eufy-security-ws emituje zdarzenia jako JSON.
-import websockets
-
-class EufyClient:
-    def __init__(self, ws_url, on_event):
-        self.ws_url = ws_url
-        self.on_event = on_event
-
-    async def run(self):
-        # Auto-reconnect pętla
-        while True:
-            try:
-                async with websockets.connect(self.ws_url, ping_interval=20, ping_timeout=20) as ws:
-                    # Subskrypcja wszystkich zdarzeń
-                    await ws.send(json.dumps({"command":"initialize"}))
-                    await ws.send(json.dumps({"command":"get_devices"}))
-                    await ws.send(json.dumps({"command":"get_stations"}))
-                    # nasłuch
-                    async for raw in ws:
-                        try:
-                            evt = json.loads(raw)
-                        except Exception:
-                            continue
-                        await self.on_event(evt)
-            except Exception:
-                await asyncio.sleep(5)  # ponów po krótkiej przerwie
+from eufy_core import Notifier, IncidentLog, WSClient, load_cfg
 
 # ---- logika zdarzeń/zdrowia ----
 class EufyMonitor:
@@ -74,7 +8,10 @@ class EufyMonitor:
         self.cfg = cfg
         self.notifier = Notifier(cfg["notify"]["cooldown_seconds"])
         self.log = IncidentLog()
-        self.device_last_ok = {}  # device_sn -> datetime
+        self.device_last_ok = {}  # device_sn -> time.monotonic()
+        self.device_names = {}    # device_sn -> nazwa do komunikatów
+        self._offline_flagged = set()
+        self._offline_grace = cfg["health"]["offline_grace_seconds"]
 
     async def handle_event(self, evt):
         # Zdarzenia mają różne kształty; reagujemy na najczęstsze pola.
@@ -93,15 +30,15 @@ class EufyMonitor:
             props = evt.get("properties") or evt.get("data") or {}
             # heurystyki "online"
             online = props.get("online") if isinstance(props.get("online"), bool) else props.get("state") in ("online","connected")
-            now = datetime.datetime.now()
+            self.device_names[dev_sn] = name
             if online:
-                self.device_last_ok[dev_sn] = now
-            else:
-                # jeżeli od X sekund brak online -> incydent
-                last_ok = self.device_last_ok.get(dev_sn, now - datetime.timedelta(hours=24))
-                if (now - last_ok).total_seconds() > self.cfg["health"]["offline_grace_seconds"]:
-                    self.notifier.show("Eufy: urządzenie offline", f"{name} nie odpowiada.", key=f"off_{dev_sn}")
-                    self.log.add(name, "incident", "Device offline", json.dumps(props))
+                self.device_last_ok[dev_sn] = time.monotonic()
+                self._offline_flagged.discard(dev_sn)
+            elif dev_sn not in self.device_last_ok:
+                # urządzenie zgłasza offline, a nigdy nie było widziane online
+                # (np. kamera leżała już przy starcie monitora) — zasiej
+                # znacznik jako dawno przeterminowany, watchdog oflaguje
+                self.device_last_ok[dev_sn] = time.monotonic() - 86400.0
 
         # 3) Globalne błędy (np. P2P/Cloud)
         if evt.get("type") in ("error","station error","device error"):
@@ -110,17 +47,64 @@ class EufyMonitor:
             self.notifier.show("Eufy: błąd", msg, key=f"err_{src}")
             self.log.add(src, "error", "Error", msg)
 
+    def _sink(self, kind, payload):
+        # adapter pod WSClient: zdarzenia do kolejki, stany połączenia na konsolę
+        if kind == "event":
+            self._enqueue(payload)
+        elif kind == "conn" and payload.get("status") != "connected":
+            print(f"[WS] rozłączono: {payload.get('error','')}")
+
+    def _enqueue(self, evt):
+        # pełna kolejka = konsument nie nadąża; upuść najstarsze
+        # zdarzenie zamiast blokować pętlę recv (backpressure na TCP)
+        if self.q.full():
+            try:
+                self.q.get_nowait()
+            except asyncio.QueueEmpty:
+                pass
+            print("[WARN] kolejka zdarzeń pełna — upuszczam najstarsze")
+        self.q.put_nowait(evt)
+
+    async def _consume(self):
+        while True:
+            evt = await self.q.get()
+            await self.handle_event(evt)
+
+    async def _watchdog(self):
+        # okresowy strażnik: wykrywa offline także przy całkowitej ciszy,
+        # a przy dużym ruchu nie sprawdza per zdarzenie
+        while True:
+            await asyncio.sleep(max(self._offline_grace / 4, 1))
+            now = time.monotonic()
+            for sn, last_ok in list(self.device_last_ok.items()):
+                if now - last_ok > self._offline_grace and sn not in self._offline_flagged:
+                    self._offline_flagged.add(sn)
+                    name = self.device_names.get(sn, sn)
+                    self.notifier.show("Eufy: urządzenie offline", f"{name} nie odpowiada.", key=f"off_{sn}")
+                    self.log.add(name, "incident", "Device offline", sn)
+
     async def run(self):
-        client = EufyClient(self.cfg["ws_url"], self.handle_event)
+        self.q = asyncio.Queue(maxsize=1024)
+        client = WSClient(self.cfg["ws_url"], self._sink)
         self.notifier.show("Eufy Monitor", "Start nasłuchu (WebSocket).", key="start")
-        await client.run()
-
-def load_cfg():
-    path = os.path.join(os.path.dirname(__file__), "config.json")
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+        consumer = asyncio.create_task(self._consume())
+        watchdog = asyncio.create_task(self._watchdog())
+        try:
+            await client.run()
+        finally:
+            consumer.cancel()
+            watchdog.cancel()
 
 if __name__ == "__main__":
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass  # uvloop opcjonalny (brak na Windows)
     cfg = load_cfg()
-    asyncio.run(EufyMonitor(cfg).run())
+    monitor = EufyMonitor(cfg)
+    try:
+        asyncio.run(monitor.run())
+    finally:
+        monitor.log.close()
 